@@ -3,7 +3,6 @@ import numpy as np
 import tensorflow as tf
 import tensorflow_datasets as tfds
 
-import itertools
 from multiprocessing import Pool
 from functools import partial
 from tensorflow_datasets.core import download
@@ -28,6 +27,7 @@ class MultiThreadedDatasetBuilder(tfds.core.GeneratorBasedBuilder):
     MAX_PATHS_IN_MEMORY = 100       # number of paths converted & stored in memory before writing to disk
                                     # -> the higher the faster / more parallel conversion, adjust based on avilable RAM
                                     # note that one path may yield multiple episodes and adjust accordingly
+    MAX_FAILURE_RATE = 0.5          # abort conversion once more than this fraction of paths was skipped
     PARSE_FCN = None                # needs to be filled with path-to-record-episode parse function
 
     def _split_generators(self, dl_manager: tfds.download.DownloadManager):
@@ -58,6 +58,7 @@ class MultiThreadedDatasetBuilder(tfds.core.GeneratorBasedBuilder):
             parse_function=type(self).PARSE_FCN,
             n_workers=self.N_WORKERS,
             max_paths_in_memory=self.MAX_PATHS_IN_MEMORY,
+            max_failure_rate=self.MAX_FAILURE_RATE,
         )
         split_generators = self._split_generators(dl_manager)
         split_generators = split_builder.normalize_legacy_split_generators(
@@ -111,9 +112,21 @@ class _SplitInfoFuture:
         return self._callback()
 
 
+def _init_worker():
+    # Every conversion worker runs its own TensorFlow runtime (for JPEG encoding): keep it on few threads and off the
+    # GPU, so N_WORKERS processes neither oversubscribe the CPU nor each try to reserve the whole GPU memory
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(1)
+        tf.config.threading.set_inter_op_parallelism_threads(2)
+        tf.config.set_visible_devices([], 'GPU')
+    except RuntimeError:
+        pass  # runtime already initialized in the parent process, keep its settings
+
+
 def parse_examples_from_generator(paths, fcn, split_name, total_num_examples, features, serializer):
     generator = fcn(paths)
     outputs = []
+    n_skipped = 0
     for sample in utils.tqdm(
             generator,
             desc=f'Generating {split_name} examples...',
@@ -122,23 +135,27 @@ def parse_examples_from_generator(paths, fcn, split_name, total_num_examples, fe
             leave=False,
             mininterval=1.0,
     ):
-        if sample is None: continue
+        if sample is None:
+            n_skipped += 1
+            continue
         key, example = sample
         try:
             example = features.encode_example(example)
         except Exception as e:  # pylint: disable=broad-except
             utils.reraise(e, prefix=f'Failed to encode example:\n{key}\n')
         outputs.append((key, serializer.serialize_example(example)))
-    return outputs
+    return outputs, n_skipped
 
 
 class ParallelSplitBuilder(split_builder_lib.SplitBuilder):
-    def __init__(self, *args, split_paths, parse_function, n_workers, max_paths_in_memory, **kwargs):
+    def __init__(self, *args, split_paths, parse_function, n_workers, max_paths_in_memory, max_failure_rate,
+                 **kwargs):
         super().__init__(*args, **kwargs)
         self._split_paths = split_paths
         self._parse_function = parse_function
         self._n_workers = n_workers
         self._max_paths_in_memory = max_paths_in_memory
+        self._max_failure_rate = max_failure_rate
 
     def _build_from_generator(
             self,
@@ -173,7 +190,8 @@ class ParallelSplitBuilder(split_builder_lib.SplitBuilder):
         paths = self._split_paths[split_name]
         path_lists = chunk_max(paths, self._n_workers, self._max_paths_in_memory)  # generate N file lists
         print(f"Generating with {self._n_workers} workers!")
-        pool = Pool(processes=self._n_workers)
+        pool = Pool(processes=self._n_workers, initializer=_init_worker)
+        n_paths_done, n_skipped = 0, 0
         for i, paths in enumerate(path_lists):
             print(f"Processing chunk {i + 1} of {len(path_lists)}.")
             results = pool.map(
@@ -189,10 +207,17 @@ class ParallelSplitBuilder(split_builder_lib.SplitBuilder):
             )
             # write results to shuffler --> this will automatically offload to disk if necessary
             print("Writing conversion results...")
-            for result in itertools.chain(*results):
-                key, serialized_example = result
-                writer._shuffler.add(key, serialized_example)
-                writer._num_examples += 1
+            for outputs, n_worker_skipped in results:
+                n_skipped += n_worker_skipped
+                for key, serialized_example in outputs:
+                    writer._shuffler.add(key, serialized_example)
+                    writer._num_examples += 1
+
+            # a systematic processing error skips every path, stop instead of silently producing an empty split
+            n_paths_done += sum(len(worker_paths) for worker_paths in paths)
+            if n_skipped > self._max_failure_rate * n_paths_done:
+                pool.terminate()
+                raise RuntimeError(f"{n_skipped} of {n_paths_done} paths failed to convert, aborting.")
         pool.close()
 
         print("Finishing split conversion...")
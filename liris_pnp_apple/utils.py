@@ -7,6 +7,12 @@ from copy import deepcopy
 from collections import defaultdict
 import pyzed.sl as sl
 
+try:
+    # Registers The Bitshuffle Filter, Needed To Read Trajectories Compressed By rechunk_hdf5 #
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
 
 camera_type_dict = {
     'hand_camera_id': 0,
@@ -22,6 +28,8 @@ camera_type_to_string_dict = {
 
 resize_func_map = {"cv2": cv2.resize, None: None}
 
+BITSHUFFLE_FILTER_ID = 32008
+
 def get_camera_type(cam_id):
     if cam_id not in camera_type_dict:
         return None
@@ -204,9 +212,9 @@ def load_hdf5_to_dict(hdf5_file, index, keys_to_ignore=[]):
             continue
 
         curr_data = hdf5_file[key]
-        if isinstance(curr_data, h5py.Group):
+        if isinstance(curr_data, (h5py.Group, dict)):
             data_dict[key] = load_hdf5_to_dict(curr_data, index, keys_to_ignore=keys_to_ignore)
-        elif isinstance(curr_data, h5py.Dataset):
+        elif isinstance(curr_data, (h5py.Dataset, np.ndarray)):
             data_dict[key] = curr_data[index]
         else:
             raise ValueError
@@ -214,12 +222,78 @@ def load_hdf5_to_dict(hdf5_file, index, keys_to_ignore=[]):
     return data_dict
 
 
+def load_hdf5_datasets(hdf5_file, keys_to_ignore=[], file_mmap=None):
+    # Read every dataset in a single call, indexing single timesteps from h5py is orders of magnitude slower #
+    data_dict = {}
+
+    for key in hdf5_file.keys():
+        if key in keys_to_ignore:
+            continue
+
+        curr_data = hdf5_file[key]
+        if isinstance(curr_data, h5py.Group):
+            data_dict[key] = load_hdf5_datasets(curr_data, keys_to_ignore=keys_to_ignore, file_mmap=file_mmap)
+        elif isinstance(curr_data, h5py.Dataset):
+            data_dict[key] = read_hdf5_dataset(curr_data, file_mmap=file_mmap)
+        else:
+            raise ValueError
+
+    return data_dict
+
+
+def read_hdf5_dataset(dataset, file_mmap=None):
+    # Contiguous, uncompressed numeric datasets are mapped zero-copy from the file #
+    offset = dataset.id.get_offset()
+    is_mappable = (
+        file_mmap is not None
+        and offset is not None
+        and dataset.chunks is None
+        and dataset.compression is None
+        and dataset.dtype.kind in "biuf"
+    )
+    if not is_mappable:
+        return dataset[()]
+
+    nbytes = dataset.size * dataset.dtype.itemsize
+    return file_mmap[offset:offset + nbytes].view(dataset.dtype).reshape(dataset.shape)
+
+
+def rechunk_hdf5(filepath, output_filepath, chunk_length=1024, bitshuffle=False):
+    # One-time conversion of a trajectory file to chunks aligned with the time axis #
+    # With bitshuffle, numeric datasets are LZ4 compressed if hdf5plugin is installed, readers then need it as well #
+    use_bitshuffle = bitshuffle and h5py.h5z.filter_avail(BITSHUFFLE_FILTER_ID)
+    with h5py.File(filepath, "r") as in_file, h5py.File(output_filepath, "w") as out_file:
+        out_file.attrs.update(in_file.attrs)
+
+        def copy_item(name, item):
+            if isinstance(item, h5py.Group):
+                out_file.require_group(name).attrs.update(item.attrs)
+            elif isinstance(item, h5py.Dataset):
+                # Strings And Scalars Are Copied As They Are, Only Numeric Arrays Get New Chunks #
+                if item.ndim == 0 or item.dtype.kind not in "biuf":
+                    in_file.copy(item, out_file, name=name)
+                    return
+                data = item[()]
+                kwargs = {}
+                if len(data) > 0:
+                    kwargs["chunks"] = (min(chunk_length, len(data)), *data.shape[1:])
+                    if use_bitshuffle:
+                        kwargs["compression"] = BITSHUFFLE_FILTER_ID
+                        kwargs["compression_opts"] = (0, 2)  # automatic block size, LZ4
+                out_file.create_dataset(name, data=data, **kwargs).attrs.update(item.attrs)
+
+        in_file.visititems(copy_item)
+
+
 class TrajectoryReader:
     def __init__(self, filepath, read_images=True):
         self._hdf5_file = h5py.File(filepath, "r")
         is_video_folder = "observations/videos" in self._hdf5_file
         self._read_images = read_images and is_video_folder
         self._length = get_hdf5_length(self._hdf5_file)
+        # Copy-On-Write Mapping, Callers May Edit The Returned Arrays In Place Without Touching The File #
+        self._file_mmap = np.memmap(filepath, dtype=np.uint8, mode="c")
+        self._hdf5_data = load_hdf5_datasets(self._hdf5_file, keys_to_ignore=["videos"], file_mmap=self._file_mmap)
         self._video_readers = {}
         self._index = 0
 
@@ -237,7 +311,7 @@ class TrajectoryReader:
 
         # Load Low Dimensional Data #
         keys_to_ignore = [*keys_to_ignore.copy(), "videos"]
-        timestep = load_hdf5_to_dict(self._hdf5_file, self._index, keys_to_ignore=keys_to_ignore)
+        timestep = load_hdf5_to_dict(self._hdf5_data, self._index, keys_to_ignore=keys_to_ignore)
 
         # Load High Dimensional Data #
         if self._read_images:
@@ -272,10 +346,26 @@ class TrajectoryReader:
     def close(self):
         self._hdf5_file.close()
 
+        # Drop The Mapping, It Is Unmapped Once No Returned Timestep Refers To It Anymore #
+        self._hdf5_data = None
+        self._file_mmap = None
+
 
-def crawler(dirname, filter_func=None):
-    subfolders = [f.path for f in os.scandir(dirname) if f.is_dir()]
-    traj_files = [f.path for f in os.scandir(dirname) if (f.is_file() and "trajectory.h5" in f.path)]
+def has_mp4_recordings(entries):
+    # Looks For recordings/MP4 Starting From The Listing Of An Episode Folder #
+    recordings = next((f for f in entries if f.name == "recordings" and f.is_dir()), None)
+    if recordings is None:
+        return False
+    with os.scandir(recordings.path) as it:
+        return any(f.name == "MP4" and f.is_dir() for f in it)
+
+
+def crawler(dirname, filter_func=None, require_mp4=False):
+    # List Each Directory Once, DirEntry Caches The File Type From The Listing #
+    with os.scandir(dirname) as it:
+        entries = list(it)
+    subfolders = [f.path for f in entries if f.is_dir()]
+    traj_files = [f.path for f in entries if (f.is_file() and f.name == "trajectory.h5")]
 
     if len(traj_files):
         # Only Save Desired Data #
@@ -286,12 +376,15 @@ def crawler(dirname, filter_func=None):
             use_data = filter_func(hdf5_file.attrs)
             hdf5_file.close()
 
+        if require_mp4:
+            use_data = use_data and has_mp4_recordings(entries)
+
         if use_data:
             return [dirname]
 
     all_folderpaths = []
     for child_dirname in subfolders:
-        child_paths = crawler(child_dirname, filter_func=filter_func)
+        child_paths = crawler(child_dirname, filter_func=filter_func, require_mp4=require_mp4)
         all_folderpaths.extend(child_paths)
 
     return all_folderpaths
@@ -4,8 +4,9 @@ import numpy as np
 import tensorflow as tf
 import tensorflow_datasets as tfds
 import os
-from PIL import Image
+import cv2
 import datetime
+import traceback
 
 from liris_pnp_peach.utils import load_trajectory, crawler
 from liris_pnp_peach.tfds_utils import MultiThreadedDatasetBuilder
@@ -20,6 +21,9 @@ DATA_PATH = "/home/panda/liris_droid/data/success"
 # (180, 320) is the default resolution, modify if different resolution is desired
 IMAGE_RES = (360, 640)
 
+# JPEG quality of the stored camera images, lower is faster to encode and smaller on disk
+JPEG_QUALITY = 90
+
 # Set the dates from which you want to compose the dataset
 INITIAL_DATE = datetime.datetime(2025, 3, 18, 14, 00, 00)
 FINAL_DATE = datetime.datetime(2025, 3, 18, 16, 30, 00)
@@ -28,11 +32,36 @@ FINAL_DATE = datetime.datetime(2025, 3, 18, 16, 30, 00)
 FILTER_NO_OPS = True
 
 
-def _generate_examples(paths) -> Iterator[Tuple[str, Any]]:
+def _resize_frames(frames):
+    """Resizes a list of uint8 BGR frames to IMAGE_RES and returns them as one [T, *IMAGE_RES, 3] RGB array."""
+    # INTER_AREA is the anti-aliased kernel for downscaling, only fall back to bicubic when upscaling
+    if frames[0].shape[1] >= IMAGE_RES[1] and frames[0].shape[0] >= IMAGE_RES[0]:
+        interpolation = cv2.INTER_AREA
+    else:
+        interpolation = cv2.INTER_CUBIC
+
+    # resize into a reused buffer and write the channel flip straight into the output
+    resized = np.empty((*IMAGE_RES, 3), dtype=np.uint8)
+    out = np.empty((len(frames), *IMAGE_RES, 3), dtype=np.uint8)
+    for t, frame in enumerate(frames):
+        cv2.resize(frame, (IMAGE_RES[1], IMAGE_RES[0]), dst=resized, interpolation=interpolation)
+        cv2.cvtColor(resized, cv2.COLOR_BGR2RGB, dst=out[t])
+    return out
+
+
+@tf.function(input_signature=[tf.TensorSpec([None, *IMAGE_RES, 3], tf.uint8)])
+def _encode_jpeg_batch(frames):
+    # single pass baseline encoding, optimized Huffman tables would need a second pass over every image
+    return tf.map_fn(
+        lambda frame: tf.io.encode_jpeg(
+            frame, quality=JPEG_QUALITY, progressive=False, optimize_size=False, chroma_downsampling=True
+        ),
+        frames,
+        fn_output_signature=tf.string,
+    )
 
-    def _resize_and_encode(image, size):
-        image = Image.fromarray(image)
-        return np.array(image.resize(size, resample=Image.BICUBIC))
+
+def _generate_examples(paths) -> Iterator[Tuple[str, Any]]:
 
     def _parse_example(episode_path):
         h5_filepath = os.path.join(episode_path, 'trajectory.h5')
@@ -40,51 +69,71 @@ def _generate_examples(paths) -> Iterator[Tuple[str, Any]]:
 
         try:
             data = load_trajectory(h5_filepath, recording_folderpath=recording_folderpath)
-        except:
-           print(f"Skipping trajectory because data couldn't be loaded for {episode_path}.")
+        except (OSError, RuntimeError, KeyError, ValueError, AssertionError):
+           print(f"Skipping trajectory because data couldn't be loaded for {episode_path}:\n{traceback.format_exc()}")
            return None
 
         # get a random language instruction
         lang = LANGUAGE_INSTRUCTION
 
         try:
-            assert all(t.keys() == data[0].keys() for t in data)
-            for t in range(len(data)):
-                for key in data[0]['observation']['image'].keys():
-                    data[t]['observation']['image'][key] = _resize_and_encode(
-                        data[t]['observation']['image'][key], (IMAGE_RES[1], IMAGE_RES[0])
-                    )
+            # missing keys in intermediate steps already fail when stacking the episode arrays below
+            assert data[-1].keys() == data[0].keys()
 
-            # assemble episode --> here we're assuming demos so we set reward to 1 at the end
-            episode = []
+            # drop no-op steps first so their frames are never resized
+            if FILTER_NO_OPS:
+                velocities = np.asarray([step['action']['cartesian_velocity'] for step in data])
+                data = [data[t] for t in np.flatnonzero(velocities.any(axis=1))]
+
+            # camera types are static over an episode, so only the two stored viewpoints are processed
+            camera_type_dict = data[0]['observation']['camera_type']
+            wrist_ids = [k for k, v in camera_type_dict.items() if v == 0]
+            exterior_ids = [k for k, v in camera_type_dict.items() if v != 0]
+            exterior_key = f'{exterior_ids[0]}_left'
+            wrist_key = f'{wrist_ids[0]}_left'
+
+            # resize all frames of one camera at once and convert them from BGR to RGB in a single pass,
+            # then encode them to JPEG up front so tfds stores the bytes as they are
+            images = {}
+            for key in (exterior_key, wrist_key):
+                frames = _resize_frames([step['observation']['image'][key] for step in data])
+                images[key] = _encode_jpeg_batch(frames).numpy()
 
-            for step in data:
-                if FILTER_NO_OPS and (step['action']['cartesian_velocity'] == 0).all():
-                    continue
+            # stack the low dimensional data of all steps once (as float32), the steps below only hold views into them
+            robot_states = [step['observation']['robot_state'] for step in data]
+            actions = [step['action'] for step in data]
+            cartesian_position = np.asarray([state['cartesian_position'] for state in robot_states], dtype=np.float32)
+            joint_position = np.asarray([state['joint_positions'] for state in robot_states], dtype=np.float32)
+            gripper_position = np.asarray([state['gripper_position'] for state in robot_states], dtype=np.float32)[:, None]
+            action_cartesian_position = np.asarray([action['cartesian_position'] for action in actions], dtype=np.float32)
+            action_cartesian_velocity = np.asarray([action['cartesian_velocity'] for action in actions], dtype=np.float32)
+            action_gripper_position = np.asarray([action['gripper_position'] for action in actions], dtype=np.float32)[:, None]
+            action_gripper_velocity = np.asarray([action['gripper_velocity'] for action in actions], dtype=np.float32)[:, None]
+            action_joint_position = np.asarray([action['joint_position'] for action in actions], dtype=np.float32)
+            action_joint_velocity = np.asarray([action['joint_velocity'] for action in actions], dtype=np.float32)
+            action = np.concatenate((action_cartesian_position, action_gripper_position), axis=1)
 
-                obs = step['observation']
-                action = step['action']
-                camera_type_dict = obs['camera_type']
-                wrist_ids = [k for k, v in camera_type_dict.items() if v == 0]
-                exterior_ids = [k for k, v in camera_type_dict.items() if v != 0]
+            # assemble episode --> here we're assuming demos so we set reward to 1 at the end
+            episode = []
 
+            for t in range(len(data)):
                 episode.append({
                     'observation': {
-                        'exterior_image_1_left': obs['image'][f'{exterior_ids[0]}_left'][..., ::-1],
-                        'wrist_image_left': obs['image'][f'{wrist_ids[0]}_left'][..., ::-1],
-                        'cartesian_position': obs['robot_state']['cartesian_position'],
-                        'joint_position': obs['robot_state']['joint_positions'],
-                        'gripper_position': np.array([obs['robot_state']['gripper_position']]),
+                        'exterior_image_1_left': images[exterior_key][t],
+                        'wrist_image_left': images[wrist_key][t],
+                        'cartesian_position': cartesian_position[t],
+                        'joint_position': joint_position[t],
+                        'gripper_position': gripper_position[t],
                     },
                     'action_dict': {
-                        'cartesian_position': action['cartesian_position'],
-                        'cartesian_velocity': action['cartesian_velocity'],
-                        'gripper_position': np.array([action['gripper_position']]),
-                        'gripper_velocity': np.array([action['gripper_velocity']]),
-                        'joint_position': action['joint_position'],
-                        'joint_velocity': action['joint_velocity'],
+                        'cartesian_position': action_cartesian_position[t],
+                        'cartesian_velocity': action_cartesian_velocity[t],
+                        'gripper_position': action_gripper_position[t],
+                        'gripper_velocity': action_gripper_velocity[t],
+                        'joint_position': action_joint_position[t],
+                        'joint_velocity': action_joint_velocity[t],
                     },
-                    'action': np.concatenate((action['cartesian_position'], [action['gripper_position']])),
+                    'action': action[t],
                     'discount': 1.0,
                     'reward': 0.0,
                     'is_first': False,
@@ -98,8 +147,9 @@ def _generate_examples(paths) -> Iterator[Tuple[str, Any]]:
             episode[-1]["is_terminal"] = True
             episode[-1]["reward"] = 1.0
 
-        except:
-           print(f"Skipping trajectory because there was an error in data processing for {episode_path}.")
+        except (KeyError, IndexError, ValueError, AssertionError, cv2.error, tf.errors.OpError):
+           print(f"Skipping trajectory because there was an error in data processing for {episode_path}:\n"
+                 f"{traceback.format_exc()}")
            return None
 
         # create output data sample
@@ -113,7 +163,7 @@ def _generate_examples(paths) -> Iterator[Tuple[str, Any]]:
         # if you want to skip an example for whatever reason, simply return None
         return episode_path, sample
 
-    # for smallish datasets, use single-thread parsing
+    # paths are already split across N_WORKERS processes by the builder, parse this worker's share sequentially
     for sample in paths:
        yield _parse_example(sample)
 
@@ -121,15 +171,18 @@ def _generate_examples(paths) -> Iterator[Tuple[str, Any]]:
 class LirisPnpPeach(MultiThreadedDatasetBuilder):
     """DatasetBuilder for example dataset."""
 
-    VERSION = tfds.core.Version('1.0.0')
+    VERSION = tfds.core.Version('1.1.0')
     RELEASE_NOTES = {
       '1.0.0': 'Initial release.',
+      '1.1.0': 'Store robot states and actions as float32, encode images with JPEG quality 90.',
     }
 
-    N_WORKERS = 4                  # number of parallel workers for data conversion
-    MAX_PATHS_IN_MEMORY = 20       # number of paths converted & stored in memory before writing to disk
-                                    # -> the higher the faster / more parallel conversion, adjust based on avilable RAM
-                                    # note that one path may yield multiple episodes and adjust accordingly
+    N_WORKERS = min(os.cpu_count() or 1, 8)  # number of parallel workers for data conversion, capped by RAM as
+                                             # each worker holds a fully decoded episode (several GB) in memory
+    MAX_PATHS_IN_MEMORY = 5 * N_WORKERS      # number of paths converted & stored in memory before writing to disk
+                                             # -> the higher the faster / more parallel conversion, adjust based on
+                                             # avilable RAM, note that one path may yield multiple episodes
+    MAX_FAILURE_RATE = 0.5                   # abort conversion once more than this fraction of paths was skipped
     PARSE_FCN = _generate_examples  # handle to parse function from file paths to RLDS episodes
 
     def _info(self) -> tfds.core.DatasetInfo:
@@ -152,55 +205,55 @@ class LirisPnpPeach(MultiThreadedDatasetBuilder):
                         ),
                         'cartesian_position': tfds.features.Tensor(
                             shape=(6,),
-                            dtype=np.float64,
+                            dtype=np.float32,
                             doc='Robot Cartesian state',
                         ),
                         'gripper_position': tfds.features.Tensor(
                             shape=(1,),
-                            dtype=np.float64,
+                            dtype=np.float32,
                             doc='Gripper position statae',
                         ),
                         'joint_position': tfds.features.Tensor(
                             shape=(7,),
-                            dtype=np.float64,
+                            dtype=np.float32,
                             doc='Joint position state'
                         )
                     }),
                     'action_dict': tfds.features.FeaturesDict({
                         'cartesian_position': tfds.features.Tensor(
                             shape=(6,),
-                            dtype=np.float64,
+                            dtype=np.float32,
                             doc='Commanded Cartesian position'
                         ),
                         'cartesian_velocity': tfds.features.Tensor(
                             shape=(6,),
-                            dtype=np.float64,
+                            dtype=np.float32,
                             doc='Commanded Cartesian velocity'
                         ),
                         'gripper_position': tfds.features.Tensor(
                             shape=(1,),
-                            dtype=np.float64,
+                            dtype=np.float32,
                             doc='Commanded gripper position'
                         ),
                         'gripper_velocity': tfds.features.Tensor(
                             shape=(1,),
-                            dtype=np.float64,
+                            dtype=np.float32,
                             doc='Commanded gripper velocity'
                         ),
                         'joint_position': tfds.features.Tensor(
                             shape=(7,),
-                            dtype=np.float64,
+                            dtype=np.float32,
                             doc='Commanded joint position'
                         ),
                         'joint_velocity': tfds.features.Tensor(
                             shape=(7,),
-                            dtype=np.float64,
+                            dtype=np.float32,
                             doc='Commanded joint velocity'
                         )
                     }),
                     'action': tfds.features.Tensor(
                         shape=(7,),
-                        dtype=np.float64,
+                        dtype=np.float32,
                         doc='Robot action, consists of [6x joint positions, \
                             1x gripper position].',
                     ),
@@ -243,15 +296,16 @@ class LirisPnpPeach(MultiThreadedDatasetBuilder):
         # create list of all examples -- by default we put all examples in 'train' split
         # add more elements to the dict below if you have more splits in your data
         print("Crawling all episode paths...")
-        episode_paths = crawler(DATA_PATH)
-        episode_paths = [p for p in episode_paths if os.path.exists(p + '/trajectory.h5') and \
-                         os.path.exists(p + '/recordings/MP4')]
-        
-        if INITIAL_DATE:
-            episode_paths = [e for e in episode_paths if datetime.datetime.strptime(e.split("/")[-1], "%a_%b_%d_%H:%M:%S_%Y") >= INITIAL_DATE]
-
-        if FINAL_DATE:
-            episode_paths = [e for e in episode_paths if datetime.datetime.strptime(e.split("/")[-1], "%a_%b_%d_%H:%M:%S_%Y") <= FINAL_DATE]
+        # only keep folders with both a trajectory.h5 file and a recordings/MP4 folder
+        episode_paths = crawler(DATA_PATH, require_mp4=True)
+
+        if INITIAL_DATE or FINAL_DATE:
+            # parse each episode timestamp only once and apply both date bounds in a single pass
+            def _in_date_range(path):
+                date = datetime.datetime.strptime(path.split("/")[-1], "%a_%b_%d_%H:%M:%S_%Y")
+                return (not INITIAL_DATE or date >= INITIAL_DATE) and (not FINAL_DATE or date <= FINAL_DATE)
+
+            episode_paths = [e for e in episode_paths if _in_date_range(e)]
 
         print(f"Found {len(episode_paths)} episodes!")
         return {
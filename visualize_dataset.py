@@ -27,14 +27,14 @@ ds = ds.shuffle(10)
 # visualize episodes
 for i, episode in enumerate(ds.take(10)):
     images_ext_1, images_ext_2, images_wrist = [], [], []
-    for step in episode['steps']:
-        images_ext_1.append(step['observation']['exterior_image_1_left'].numpy())
-        images_wrist.append(step['observation']['wrist_image_left'].numpy())
+    for step in episode['steps'].prefetch(tf.data.AUTOTUNE).as_numpy_iterator():
+        images_ext_1.append(step['observation']['exterior_image_1_left'])
+        images_wrist.append(step['observation']['wrist_image_left'])
 
     image_strip_ext_1 = np.concatenate(images_ext_1[::4], axis=1)
     image_strip_wrist = np.concatenate(images_wrist[::4], axis=1)
     image_strip = np.concatenate((image_strip_ext_1, image_strip_wrist), axis=0)
-    caption = step['language_instruction'].numpy().decode() + ' (temp. downsampled 4x)'
+    caption = step['language_instruction'].decode() + ' (temp. downsampled 4x)'
 
     if render_wandb:
         wandb.log({f'image_{i}': wandb.Image(image_strip, caption=caption)})
@@ -44,13 +44,15 @@ for i, episode in enumerate(ds.take(10)):
         plt.title(caption)
 
 # visualize action and state statistics
+steps = ds.take(500).flat_map(lambda episode: episode['steps'])
+steps = steps.map(lambda step: (step['action'], step['observation']['cartesian_position']))
+steps = steps.batch(4096).prefetch(tf.data.AUTOTUNE)
 actions, states = [], []
-for episode in tqdm.tqdm(ds.take(500)):
-    for step in episode['steps']:
-        actions.append(step['action'].numpy())
-        states.append(step['observation']['cartesian_position'].numpy())
-actions = np.array(actions)
-states = np.array(states)
+for action_batch, state_batch in tqdm.tqdm(steps.as_numpy_iterator()):
+    actions.append(action_batch)
+    states.append(state_batch)
+actions = np.concatenate(actions)
+states = np.concatenate(states)
 action_mean = actions.mean(0)
 state_mean = states.mean(0)
 